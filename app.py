@@ -1,24 +1,35 @@
 import streamlit as st
 import numpy as np
-import soundfile as sf
+import gc
 import io
+import logging
+import os
+import struct
+import threading
+os.environ.setdefault("PYTORCH_ENABLE_MPS_FALLBACK", "1") # Ops missing on Apple MPS fall back to CPU
 import torch # KPipeline might return torch tensors
-from pydub import AudioSegment
+try:
+    import lameenc # In-process MP3 encoding, no ffmpeg subprocess
+except ImportError:
+    lameenc = None
+    from pydub import AudioSegment # Fallback: MP3 export through ffmpeg
+from collections import OrderedDict # LRU order for the audio store
 from datetime import datetime # To timestamp history entries
 import uuid # To give unique keys to history items
-from kokoro import KPipeline # <--- ADD THIS LINE HERE
+from kokoro import KModel, KPipeline
+
+logger = logging.getLogger(__name__)
 
 # --- Installation Notes ---
-# (Keep installation notes as before)
-# 1. Make sure 'kokoro', 'soundfile', 'pydub' are installed: pip install kokoro soundfile pydub
+# 1. Make sure 'kokoro' and 'lameenc' are installed: pip install kokoro lameenc
+#    (If 'lameenc' is unavailable, 'pydub' + FFmpeg is used for MP3 export instead.)
 # 2. CRITICAL: 'espeak-ng' must be installed on the system.
 #    - Debian/Ubuntu: sudo apt-get update && sudo apt-get install espeak-ng ffmpeg
 #    - macOS (brew): brew install espeak-ng ffmpeg
 #    - Windows: Requires manual installation or WSL.
-# 3. FFmpeg is needed by pydub for MP3 export.
+# 3. FFmpeg is only needed by the pydub fallback for MP3 export.
 
-ALL_VOICE_IDS = sorted([
-    # (Voice IDs remain the same)
+ALL_VOICE_IDS = tuple(sorted([
     'af_heart', 'af_alloy', 'af_aoede', 'af_bella', 'af_jessica', 'af_kore',
     'af_nicole', 'af_nova', 'af_river', 'af_sarah', 'af_sky', 'am_adam',
     'am_echo', 'am_eric', 'am_fenrir', 'am_liam', 'am_michael', 'am_onyx',
@@ -29,74 +40,294 @@ ALL_VOICE_IDS = sorted([
     'zm_yunxia', 'zm_yunyang', 'ef_dora', 'em_alex', 'em_santa', 'ff_siwis',
     'hf_alpha', 'hf_beta', 'hm_omega', 'hm_psi', 'if_sara', 'im_nicola',
     'pf_dora', 'pm_alex', 'pm_santa',
-])
+]))
+_VOICE_INDEX = {voice: i for i, voice in enumerate(ALL_VOICE_IDS)}
+_DEFAULT_INDEX = _VOICE_INDEX.get("af_bella", 0)
+
+# Kokoro selects its G2P frontend by lang_code; voice IDs start with their language's code
+# (a: American English, b: British English, j: Japanese, z: Mandarin, e: Spanish,
+#  f: French, h: Hindi, i: Italian, p: Brazilian Portuguese).
+VOICE_LANG_CODES = {'a': 'a', 'b': 'b', 'j': 'j', 'z': 'z', 'e': 'e', 'f': 'f', 'h': 'h', 'i': 'i', 'p': 'p'}
+KOKORO_REPO_ID = 'hexgrad/Kokoro-82M'
 
 # --- Model Loading (Cached) ---
-@st.cache_resource
-def load_kokoro_pipeline():
-    """Loads the Kokoro pipeline. Cached by Streamlit."""
-    st.info("Loading Kokoro TTS model... (This happens only once per session)")
+def select_device():
+    """Picks the fastest available torch device: CUDA, then Apple MPS, then CPU."""
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+def configure_torch_runtime():
+    """Process-wide torch settings for inference; called once before the model is loaded."""
+    torch.set_float32_matmul_precision('high')
+    # cudnn.benchmark stays off: input length changes with every sentence, and autotuning
+    # would re-run for each new shape.
+    if not torch.cuda.is_available():
+        torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+
+def warmup_kokoro_pipeline(pipeline, voice='af_bella'):
+    """Runs a dummy utterance so the first user prompt doesn't pay the one-time load costs."""
+    try:
+        with torch.inference_mode():
+            for _ in range(2):
+                list(pipeline(" .", voice=voice))
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+            torch.cuda.empty_cache()
+    except Exception as e:
+        # Warmup is best-effort; the real request will surface any actual error
+        logger.warning("Kokoro warmup failed (continuing anyway): %s", e)
+
+@st.cache_resource(show_spinner="Loading Kokoro TTS model... (This happens only once)")
+def _load_kokoro_model():
+    """Loads the Kokoro weights once; every language's pipeline shares this instance."""
+    configure_torch_runtime()
+    return KModel(repo_id=KOKORO_REPO_ID).to(select_device()).eval()
+
+@st.cache_resource(show_spinner="Loading Kokoro language frontend... (This happens only once per language)")
+def _load_kokoro_pipeline(lang_code):
+    """Builds and warms the pipeline (G2P frontend + voices) for one language around the shared model."""
+    pipeline = KPipeline(lang_code=lang_code, repo_id=KOKORO_REPO_ID, model=_load_kokoro_model())
+    warmup_kokoro_pipeline(pipeline, next(v for v in ALL_VOICE_IDS if v[0] == lang_code))
+    return pipeline
+
+def load_kokoro_pipeline(lang_code='a'):
+    """Returns the cached pipeline for one language, or None after reporting why it failed.
+
+    UI messages live here rather than in the cached loaders, so Streamlit doesn't replay
+    them on every cache hit; failures raise out of the loaders and are therefore not cached.
+    """
     try:
-        pipeline = KPipeline(lang_code='a')
-        st.success("Kokoro TTS model loaded.")
-        return pipeline
+        return _load_kokoro_pipeline(lang_code)
     except Exception as e:
         st.error(f"Failed to load Kokoro pipeline: {e}")
         st.warning("Ensure 'espeak-ng' is correctly installed and accessible.")
         st.exception(e)
         return None
 
+def pipeline_for_voice(voice):
+    """Returns the shared pipeline for the voice's language (American English if unknown)."""
+    return load_kokoro_pipeline(VOICE_LANG_CODES.get(voice[:1], 'a'))
+
 # --- Speech Generation Function ---
-# (generate_speech_kokoro function remains largely the same)
-def generate_speech_kokoro(text, pipeline, voice):
+SAMPLING_RATE = 24000 # Kokoro uses 24kHz
+FRAME_SAMPLES = SAMPLING_RATE // 2 # Small model chunks are coalesced into frames of at least 0.5s
+# Kokoro synthesizes (and yields) each piece of text between matches separately, in order.
+# Split on blank lines (Kokoro's default) and after sentence-ending punctuation, except
+# after common abbreviations and single letters ("Mr. Smith", "e.g.", "J. R. R.").
+SENTENCE_SPLIT_PATTERN = (r'(?<=[.!?])(?<!\bMr\.)(?<!\bMrs\.)(?<!\bMs\.)(?<!\bDr\.)(?<!\bSt\.)(?<!\bvs\.)'
+                          r'(?<!\b[A-Za-z]\.)\s+|\n+')
+
+@torch.inference_mode() # No autograd bookkeeping; applied to each step of the generator
+def generate_speech_kokoro(text, voice):
+    """Yields (graphemes, phonemes, audio frame) as soon as KPipeline produces enough audio.
+
+    Text is split into sentences (SENTENCE_SPLIT_PATTERN), so the first sentence is ready
+    without waiting for the rest of a long prompt. Chunks shorter than FRAME_SAMPLES are
+    merged with the following ones, so callers see fewer, larger frames. KModel already
+    returns its audio on the CPU, so frames are CPU tensors (viewed as numpy without a copy
+    by join_audio_chunks). Once generation ends, garbage is collected and the CUDA
+    allocator cache is released, so memory does not drift upward over a long chat.
+    Errors are reported with st.error and re-raised as RuntimeError.
+    """
     if not text:
         st.warning("Input text is empty.")
-        return None, None
+        return
+    pipeline = pipeline_for_voice(voice)
     if pipeline is None:
         st.error("Kokoro pipeline is not loaded.")
-        return None, None
+        return
+    generator = None
+    frame_gs, frame_ps, frame_chunks, frame_length = [], [], [], 0
     try:
         # st.info(f"Generating audio with voice: {voice}...") # Can be noisy in chat
-        generator = pipeline(text, voice=voice)
-        audio_chunks = []
+        generator = pipeline(text, voice=voice, split_pattern=SENTENCE_SPLIT_PATTERN)
         for i, (gs, ps, audio_chunk) in enumerate(generator):
             if torch.is_tensor(audio_chunk):
-                audio_chunk = audio_chunk.cpu().numpy()
-            if isinstance(audio_chunk, np.ndarray):
-                audio_chunks.append(audio_chunk)
-        if not audio_chunks:
-            st.warning("Model did not generate any audio output.")
-            return None, None
-        full_audio_waveform = np.concatenate(audio_chunks)
-        sampling_rate = 24000 # Kokoro uses 24kHz
-        return full_audio_waveform, sampling_rate
+                # Materialize the output so no view keeps the model's intermediate buffers alive
+                audio_chunk = audio_chunk.detach().contiguous()
+            elif not isinstance(audio_chunk, np.ndarray):
+                continue
+            frame_gs.append(gs)
+            frame_ps.append(ps)
+            frame_chunks.append(audio_chunk)
+            frame_length += len(audio_chunk)
+            if frame_length >= FRAME_SAMPLES:
+                yield _merge_frame(frame_gs, frame_ps, frame_chunks)
+                frame_gs, frame_ps, frame_chunks, frame_length = [], [], [], 0
+        if frame_chunks:
+            yield _merge_frame(frame_gs, frame_ps, frame_chunks)
     except ValueError as ve:
         if "Voice" in str(ve) and "not found" in str(ve):
             st.error(f"Error: Voice ID '{voice}' not found.")
         else:
             st.error(f"An error occurred during generation: {ve}")
-        return None, None
+        # Re-raise so callers can tell a failed run (possibly after some frames) from a finished one
+        raise RuntimeError("Audio generation failed.") from ve
     except Exception as e:
         st.error(f"An unexpected error occurred during audio generation: {e}")
         st.exception(e)
-        return None, None
+        raise RuntimeError("Audio generation failed.") from e
+    finally:
+        del generator, frame_chunks
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+def _merge_frame(frame_gs, frame_ps, frame_chunks):
+    """Combines buffered chunks into one (graphemes, phonemes, audio) frame."""
+    if len(frame_chunks) == 1:
+        audio = frame_chunks[0]
+    elif all(torch.is_tensor(chunk) for chunk in frame_chunks):
+        audio = torch.cat(frame_chunks)
+    else:
+        audio = join_audio_chunks(frame_chunks)
+    return " ".join(g for g in frame_gs if g), " ".join(p for p in frame_ps if p), audio
+
+# --- Helper Functions for Audio Storage ---
+def join_audio_chunks(audio_chunks, total_length=None):
+    """Copies chunks into a single buffer allocated once (no intermediate np.concatenate copy)."""
+    if total_length is None:
+        total_length = sum(len(chunk) for chunk in audio_chunks)
+    audio_chunks = [chunk.numpy() if torch.is_tensor(chunk) else chunk for chunk in audio_chunks]
+    full_audio_waveform = np.empty(total_length, dtype=audio_chunks[0].dtype)
+    offset = 0
+    for chunk in audio_chunks:
+        full_audio_waveform[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return full_audio_waveform
+
+def trim_silence(waveform, threshold=1e-3):
+    """Drops near-silent samples from both ends (all-silent audio is returned unchanged)."""
+    mask = np.abs(waveform) > threshold
+    if not mask.any():
+        return waveform
+    start = mask.argmax()
+    end = len(mask) - mask[::-1].argmax()
+    return waveform[start:end]
+
+def to_pcm16(waveform, copy=True):
+    """Quantizes a float waveform in [-1, 1] to int16 PCM (what chat messages store).
+
+    With copy=False the float buffer is clipped and scaled in place, so the only new
+    allocation is the int16 output.
+    """
+    if waveform.dtype == np.int16:
+        return waveform
+    scaled = np.clip(waveform, -1.0, 1.0, out=None if copy else waveform)
+    np.multiply(scaled, 32767, out=scaled)
+    return scaled.astype(np.int16)
+
+def finalize_audio(audio_chunks, total_length=None):
+    """Joins generated chunks, trims edge silence and quantizes to the stored int16 PCM."""
+    # The joined buffer is ours, so it can be quantized in place
+    return to_pcm16(trim_silence(join_audio_chunks(audio_chunks, total_length)), copy=False)
+
+def pcm16_to_wav_bytes(pcm16, sampling_rate=SAMPLING_RATE):
+    """Wraps mono int16 PCM in a WAV container, only when it is played or downloaded.
+
+    The 44-byte RIFF header is packed directly; libsndfile's format layer is overkill here.
+    """
+    data = pcm16.astype('<i2', copy=False).tobytes()
+    header = struct.pack('<4sI4s4sIHHIIHH4sI',
+                         b'RIFF', 36 + len(data), b'WAVE',
+                         b'fmt ', 16, 1, 1, sampling_rate, sampling_rate * 2, 2, 16, # PCM, mono, 16-bit
+                         b'data', len(data))
+    return header + data
 
 # --- Helper Function for MP3 Conversion (needed for download button) ---
-def convert_wav_to_mp3(wav_bytes):
-    """Converts WAV bytes to MP3 bytes using pydub."""
-    if not wav_bytes:
+def convert_to_mp3(waveform, sampling_rate=SAMPLING_RATE):
+    """Converts a mono waveform (float in [-1, 1] or int16) to MP3 bytes."""
+    if waveform is None or len(waveform) == 0:
         return None
     try:
-        wav_bytes_io = io.BytesIO(wav_bytes)
-        audio_segment = AudioSegment.from_wav(wav_bytes_io)
+        waveform = to_pcm16(waveform)
+        if lameenc is not None:
+            encoder = lameenc.Encoder()
+            encoder.set_bit_rate(192)
+            encoder.set_in_sample_rate(sampling_rate)
+            encoder.set_channels(1)
+            encoder.set_quality(5)
+            return bytes(encoder.encode(waveform.tobytes()) + encoder.flush())
+        audio_segment = AudioSegment(data=waveform.tobytes(), sample_width=2, frame_rate=sampling_rate, channels=1)
         mp3_bytes_io = io.BytesIO()
         audio_segment.export(mp3_bytes_io, format="mp3", bitrate="192k")
-        mp3_bytes_io.seek(0)
         return mp3_bytes_io.getvalue()
     except Exception as e:
-        st.error(f"MP3 conversion failed. Is FFmpeg installed and in PATH?\nError: {e}")
+        st.error(f"MP3 conversion failed. Install 'lameenc', or make sure FFmpeg is installed and in PATH.\nError: {e}")
         return None
 
+@st.cache_data(show_spinner=False, max_entries=64, ttl=3600)
+def _mp3_for(msg_id, _pcm16):
+    """MP3 bytes for a chat message, encoded once per message id (the PCM array is not hashed)."""
+    return convert_to_mp3(_pcm16)
+
+# --- Server-Side Audio Store ---
+AUDIO_STORE_MAX_BYTES = 256 * 1024 * 1024 # About 90 minutes of 24kHz int16 audio, across all sessions
+
+@st.cache_resource
+def _audio_store():
+    """Message id -> int16 PCM (least recently used first), shared by the server process.
+
+    Keeping audio here instead of in `st.session_state` means session state only holds
+    small message metadata. The store is bounded by AUDIO_STORE_MAX_BYTES, so audio of
+    expired or abandoned sessions is eventually evicted; deleting a chat evicts it at once.
+    """
+    return {"entries": OrderedDict(), "nbytes": 0, "lock": threading.Lock()}
+
+def store_audio(msg_id, pcm16):
+    """Adds a message's audio, evicting the least recently used entries over the size bound."""
+    store = _audio_store()
+    evicted_ids = []
+    with store["lock"]:
+        store["entries"][msg_id] = pcm16
+        store["nbytes"] += pcm16.nbytes
+        while store["nbytes"] > AUDIO_STORE_MAX_BYTES and len(store["entries"]) > 1:
+            evicted_id, evicted = store["entries"].popitem(last=False)
+            store["nbytes"] -= evicted.nbytes
+            evicted_ids.append(evicted_id)
+    for evicted_id in evicted_ids:
+        _mp3_for.clear(evicted_id, None)
+
+def get_audio(msg_id):
+    """Returns a message's int16 PCM (marking it recently used), or None if it was evicted."""
+    store = _audio_store()
+    with store["lock"]:
+        pcm16 = store["entries"].get(msg_id)
+        if pcm16 is not None:
+            store["entries"].move_to_end(msg_id)
+        return pcm16
+
+def evict_audio(msg_id):
+    """Drops a message's audio and its cached MP3."""
+    store = _audio_store()
+    with store["lock"]:
+        pcm16 = store["entries"].pop(msg_id, None)
+        if pcm16 is not None:
+            store["nbytes"] -= pcm16.nbytes
+    _mp3_for.clear(msg_id, None)
+
+# --- Cached Synthesis (repeat prompts) ---
+@st.cache_data(show_spinner=False, max_entries=64, ttl=3600)
+def _synth(text, voice, _streamed_pcm16=None):
+    """Returns (int16 PCM, sampling rate) for text/voice.
+
+    main() streams new prompts itself and, only when the stream finished without error,
+    passes the result as `_streamed_pcm16` (not hashed) to seed the cache. Otherwise the
+    text is synthesized here with the shared pipelines. Raises RuntimeError when generation
+    fails, even part-way, or produces no audio, so neither failures nor truncated audio
+    are ever cached.
+    """
+    if _streamed_pcm16 is not None:
+        return _streamed_pcm16, SAMPLING_RATE
+    # generate_speech_kokoro raises on any failure, so a partial list never reaches the cache
+    audio_chunks = [chunk for gs, ps, chunk in generate_speech_kokoro(text, voice)]
+    if not audio_chunks:
+        raise RuntimeError(f"Kokoro produced no audio for voice '{voice}'.")
+    return finalize_audio(audio_chunks), SAMPLING_RATE
+
 # --- Main Application ---
 def main():
     st.set_page_config(layout="wide", page_title="Kokoro TTS Chat")
@@ -106,14 +337,18 @@ def main():
     # `chats`: Dictionary to store all chat sessions. Key is chat_id, Value is list of messages.
     # `active_chat_id`: The ID of the chat currently displayed in the main area.
     # `chat_counter`: Simple way to generate unique chat IDs.
+    # `synthesized`: (text, voice) pairs already in the `_synth` cache, served without re-synthesis.
     if 'chats' not in st.session_state:
         st.session_state.chats = {}
     if 'active_chat_id' not in st.session_state:
         st.session_state.active_chat_id = None
     if 'chat_counter' not in st.session_state:
         st.session_state.chat_counter = 0
+    if 'synthesized' not in st.session_state:
+        st.session_state.synthesized = set()
 
     # --- Load Model ---
+    # American English is loaded up front; other languages load on first use of one of their voices
     pipeline = load_kokoro_pipeline()
     if pipeline is None:
         st.error("Application cannot start because the Kokoro pipeline failed to load.")
@@ -134,6 +369,15 @@ def main():
             st.session_state.active_chat_id = new_chat_id
             st.rerun() # Rerun to reflect the new active chat
 
+        # --- Delete Chat Button (also frees its audio from the server-side store) ---
+        if st.session_state.active_chat_id in st.session_state.chats:
+            if st.button("🗑️ Delete Chat", use_container_width=True):
+                deleted_chat = st.session_state.chats.pop(st.session_state.active_chat_id)
+                for msg in deleted_chat["messages"]:
+                    evict_audio(msg['id'])
+                st.session_state.active_chat_id = None
+                st.rerun()
+
         st.markdown("---")
 
         # --- List Existing Chats ---
@@ -163,28 +407,26 @@ def main():
         st.markdown("---")
         st.header("Configuration")
         # --- Voice Selection ---
-        default_voice = "af_bella"
-        try:
-            default_index = ALL_VOICE_IDS.index(default_voice)
-        except ValueError:
-            default_index = 0
-
         # Use a consistent key for the voice selector
         selected_voice = st.selectbox(
             "Select Voice:",
             options=ALL_VOICE_IDS,
-            index=default_index,
+            index=_DEFAULT_INDEX,
             key="voice_selector_main", # Unique key
             help="Choose a voice. This applies to the next generation in the active chat."
         )
 
+        if st.button("Clear Synthesis Cache", use_container_width=True, help="Forget cached audio for repeated prompts."):
+            _synth.clear()
+            st.session_state.synthesized = set()
+
         # --- Dependency Info ---
         with st.expander("Dependency Info"):
             st.markdown("""
             Uses [hexgrad/Kokoro-82M](https://huggingface.co/hexgrad/Kokoro-82M).
             **Requires system dependencies:**
             * `espeak-ng`
-            * `ffmpeg` (for MP3)
+            * `ffmpeg` (for MP3, only if `lameenc` is not installed)
             Install via package manager (e.g., `apt`, `brew`).
             """)
 
@@ -203,39 +445,50 @@ def main():
 
         # --- Display Past Messages ---
         for i, msg in enumerate(messages):
-            # Display User Input Text
-            with st.chat_message("user"):
-                 st.markdown(f"**Text:**\n```\n{msg['text']}\n```")
-                 st.caption(f"Voice: {msg['voice']} | Time: {msg['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
-
-            # Display Assistant Response (Audio)
-            with st.chat_message("assistant"):
-                 st.audio(msg['wav_bytes'], format='audio/wav')
-
-                 # --- Download Buttons ---
-                 col1, col2 = st.columns(2)
-                 with col1:
-                     st.download_button(
-                         label="Download WAV",
-                         data=msg['wav_bytes'],
-                         file_name=f"{active_chat_id}_msg{i+1}_{msg['voice']}.wav",
-                         mime="audio/wav",
-                         key=f"wav_dl_{active_chat_id}_{msg['id']}" # Unique key per message
-                     )
-                 with col2:
-                     # Generate MP3 on demand for download
-                     mp3_bytes = convert_wav_to_mp3(msg['wav_bytes'])
-                     if mp3_bytes:
-                          st.download_button(
-                              label="Download MP3",
-                              data=mp3_bytes,
-                              file_name=f"{active_chat_id}_msg{i+1}_{msg['voice']}.mp3",
-                              mime="audio/mpeg",
-                              key=f"mp3_dl_{active_chat_id}_{msg['id']}" # Unique key per message
-                          )
-                     else:
-                          # Show placeholder if conversion failed
-                          st.button("MP3 Error", disabled=True, help="MP3 conversion failed. Check console/logs and ensure FFmpeg is installed.", key=f"mp3_err_{active_chat_id}_{msg['id']}")
+            # Older messages start collapsed; only the latest is expanded
+            with st.expander(f"Message {i+1} – {msg['voice']}", expanded=(i == len(messages) - 1)):
+                # Display User Input Text
+                with st.chat_message("user"):
+                     st.markdown(f"**Text:**\n```\n{msg['text']}\n```")
+                     st.caption(f"Voice: {msg['voice']} | Time: {msg['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
+
+                # Display Assistant Response (Audio)
+                with st.chat_message("assistant"):
+                     pcm16 = get_audio(msg['id'])
+                     if pcm16 is None:
+                          st.warning("Audio for this message is no longer available.")
+                          continue
+                     wav_bytes = pcm16_to_wav_bytes(pcm16)
+                     st.audio(wav_bytes, format='audio/wav')
+
+                     # --- Download Buttons ---
+                     col1, col2 = st.columns(2)
+                     with col1:
+                         st.download_button(
+                             label="Download WAV",
+                             data=wav_bytes,
+                             file_name=f"{active_chat_id}_msg{i+1}_{msg['voice']}.wav",
+                             mime="audio/wav",
+                             key=f"wav_dl_{active_chat_id}_{msg['id']}" # Unique key per message
+                         )
+                     with col2:
+                         # Encode MP3 only once the user asks for it, then reuse the cached bytes
+                         if not msg.get('mp3_requested'):
+                              if st.button("Prepare MP3", key=f"mp3_prep_{active_chat_id}_{msg['id']}"):
+                                   msg['mp3_requested'] = True
+                         if msg.get('mp3_requested'):
+                              mp3_bytes = _mp3_for(msg['id'], pcm16)
+                              if mp3_bytes:
+                                   st.download_button(
+                                       label="Download MP3",
+                                       data=mp3_bytes,
+                                       file_name=f"{active_chat_id}_msg{i+1}_{msg['voice']}.mp3",
+                                       mime="audio/mpeg",
+                                       key=f"mp3_dl_{active_chat_id}_{msg['id']}" # Unique key per message
+                                   )
+                              else:
+                                   # Show placeholder if conversion failed
+                                   st.button("MP3 Error", disabled=True, help="MP3 conversion failed. Check console/logs and ensure lameenc (or FFmpeg) is installed.", key=f"mp3_err_{active_chat_id}_{msg['id']}")
 
 
         # --- Handle New Input ---
@@ -245,25 +498,51 @@ def main():
             # We might skip this intermediate display if preferred
 
             # 2. Generate Audio
-            with st.spinner("Generating audio..."):
-                 audio_waveform, sampling_rate = generate_speech_kokoro(prompt, pipeline, selected_voice)
+            synth_key = (prompt, selected_voice)
+            if synth_key in st.session_state.synthesized:
+                 # Repeat prompt: served from the synthesis cache (re-synthesized if it expired)
+                 with st.spinner("Generating audio..."):
+                      try:
+                           pcm16, _ = _synth(prompt, selected_voice)
+                      except RuntimeError:
+                           pcm16 = None
+            else:
+                 # New prompt: stream sentence by sentence. The first frame is previewed once and left
+                 # playing (re-rendering st.audio would restart it); the full audio shows after the rerun.
+                 pcm16 = None
+                 audio_chunks = []
+                 total_length = 0
+                 preview = st.empty()
+                 with st.spinner("Generating audio..."):
+                      try:
+                           for i, (gs, ps, chunk) in enumerate(generate_speech_kokoro(prompt, selected_voice)):
+                               audio_chunks.append(chunk)
+                               total_length += len(chunk)
+                               if i == 0:
+                                   preview.audio(join_audio_chunks(audio_chunks, total_length), sample_rate=SAMPLING_RATE)
+                      except RuntimeError:
+                           # Failed part-way: discard the partial audio rather than store a truncated message
+                           preview.empty()
+                      else:
+                           if audio_chunks:
+                                # Keep int16 PCM only; the WAV container is built on demand when rendered
+                                pcm16 = finalize_audio(audio_chunks, total_length)
+                                # Only a stream that finished without error may seed the shared cache
+                                _synth(prompt, selected_voice, _streamed_pcm16=pcm16)
+                                st.session_state.synthesized.add(synth_key)
+                 del audio_chunks # Let the per-chunk arrays be reclaimed
 
             # 3. Process and Add to State if Successful
-            if audio_waveform is not None and sampling_rate is not None:
+            if pcm16 is not None:
                  try:
-                     # Convert to WAV bytes
-                     wav_bytes_io = io.BytesIO()
-                     sf.write(wav_bytes_io, audio_waveform, sampling_rate, format='WAV', subtype='PCM_16')
-                     wav_bytes = wav_bytes_io.getvalue()
-
-                     # Create the message entry
+                     # Create the message entry (audio lives in the server-side store, keyed by id)
                      new_message = {
                          "id": str(uuid.uuid4()), # Unique ID for the message
                          "text": prompt,
                          "voice": selected_voice,
-                         "wav_bytes": wav_bytes, # Store WAV bytes
                          "timestamp": datetime.now()
                      }
+                     store_audio(new_message["id"], pcm16) # int16 PCM at SAMPLING_RATE
 
                      # Append the new message pair to the active chat
                      st.session_state.chats[active_chat_id]["messages"].append(new_message)